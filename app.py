@@ -1,3 +1,5 @@
+import csv
+import uuid
 import streamlit as st
 import pandas as pd
 from pathlib import Path
@@ -11,39 +13,182 @@ NUTRITION_FILE = Path("nutrition.csv")
 
 # ----------------- UTILITIES -----------------
 
-def load_csv(path: Path, columns: list):
-    """Load a CSV file and ensure required columns exist."""
+def ensure_date_col(df: pd.DataFrame, col: str = "date"):
+    """Ensure a column is parsed as date (no time component) safely."""
+    if df.empty:
+        return df
+    # Fast path: the format we write ourselves, which has no time portion
+    parsed = pd.to_datetime(df[col], format="%Y-%m-%d", errors='coerce')
+    # Anything else (e.g. m/d/Y from older files or imports) is parsed per value
+    missed = parsed.isna() & df[col].notna()
+    if missed.any():
+        # utc=True so values with an offset don't make the column tz-aware
+        fallback = pd.to_datetime(df.loc[missed, col], format="mixed", errors='coerce', utc=True)
+        parsed.loc[missed] = fallback.dt.tz_localize(None).dt.normalize()  # removes time portion
+    df[col] = parsed
+    return df
+
+def sort_by_date(df: pd.DataFrame, col: str = "date"):
+    """Return rows in chronological order (stable, undated rows first).
+
+    Frames are kept in this order so pages can show newest-first with a
+    reversed slice instead of sorting on every rerun.
+    """
+    return df.sort_values(col, kind="stable", na_position="first", ignore_index=True)
+
+def apply_schema(df: pd.DataFrame, columns: list, dtypes: dict):
+    """Conform a frame to `columns` and `dtypes`; numbers that don't parse become NA.
+
+    An integer column holding fractional or out-of-range values is kept as
+    float64 rather than truncated or wrapped.
+    """
+    df = df.reindex(columns=list(columns))
+    for col, dtype in dtypes.items():
+        values = df[col]
+        if dtype not in ("category", "string"):
+            values = pd.to_numeric(values, errors="coerce")
+        if dtype == "Int32":
+            known = values.dropna()
+            if not (known.eq(known.round()) & known.between(-2**31, 2**31 - 1)).all():
+                dtype = "float64"
+        df[col] = values.astype(dtype)
+    return df
+
+def read_table(source, columns: list, dtypes: dict):
+    """Read a CSV path or upload into `columns` and `dtypes`.
+
+    The typed read skips inference; numbers are read as float64 so they can
+    be range-checked before narrowing. If a cell doesn't parse, the file is
+    re-read as text and the numeric columns are coerced instead.
+    """
+    read_dtypes = {
+        col: dtype if dtype in ("category", "string") else "float64"
+        for col, dtype in dtypes.items()
+    }
+    try:
+        df = pd.read_csv(source, usecols=lambda c: c in columns, dtype=read_dtypes)
+    except ValueError:
+        if hasattr(source, "seek"):
+            source.seek(0)
+        df = pd.read_csv(source, usecols=lambda c: c in columns, dtype=str)
+    return apply_schema(df, columns, dtypes)
+
+@st.cache_data(max_entries=4)  # current + previous version of each data file
+def _read_csv_cached(path_str: str, mtime_ns: int, size: int, columns: tuple, dtypes: dict):
+    """Read, reshape and date-parse a CSV file.
+
+    `mtime_ns` and `size` are only part of the cache key, so the file is
+    re-read only after it changes on disk.
+    """
+    df = read_table(path_str, columns, dtypes)
+    return sort_by_date(ensure_date_col(df, "date"))
+
+def load_csv(path: Path, columns: list, dtypes: dict):
+    """Load a CSV file with explicit column dtypes and ensure required columns exist."""
     if path.exists():
-        df = pd.read_csv(path)
-        for col in columns:
-            if col not in df.columns:
-                df[col] = None
-        return df[columns]
-    else:
-        return pd.DataFrame(columns=columns)
+        stat = path.stat()
+        try:
+            return _read_csv_cached(
+                str(path), stat.st_mtime_ns, stat.st_size, tuple(columns), dtypes
+            )
+        except (ValueError, TypeError) as e:
+            # Keep the page usable (e.g. to import a corrected file)
+            st.error(f"Could not read {path}: {e}")
+    return pd.DataFrame(columns=columns).astype(dtypes)
 
 def save_csv(df: pd.DataFrame, path: Path):
-    """Save DataFrame to CSV."""
+    """Save DataFrame to CSV, replacing the file."""
     df.to_csv(path, index=False)
 
-def ensure_date_col(df: pd.DataFrame, col: str = "date"):
-    """Ensure a column is parsed as date (no time component) safely."""
-    if df.empty:
-        return df
-    df[col] = pd.to_datetime(df[col], errors='coerce', infer_datetime_format=True)
-    df[col] = df[col].dt.normalize()  # removes time portion
+def append_row(path: Path, columns: list, row: dict):
+    """Append one row to a CSV file whose header matches `columns`.
+
+    A missing or empty file is started with the header. Returns False without
+    writing if the existing header differs, so the caller can rewrite the
+    whole file with save_csv instead. A last line without a trailing newline
+    (e.g. after hand-editing) is terminated first so the new row isn't glued on.
+    """
+    header = None
+    needs_newline = False
+    if path.exists():
+        with path.open(newline="") as f:
+            header = next(csv.reader(f), None)
+        if header is not None and header != list(columns):
+            return False
+        if header is not None:
+            with path.open("rb") as f:
+                f.seek(-1, 2)
+                needs_newline = f.read(1) not in (b"\n", b"\r")
+    with path.open("a", newline="") as f:
+        if needs_newline:
+            f.write("\n")
+        writer = csv.writer(f, lineterminator="\n")
+        if header is None:
+            writer.writerow(columns)
+        writer.writerow([row[c] for c in columns])
+    return True
+
+def store_frame(key: str, df: pd.DataFrame):
+    """Keep `df` in session state under `key`, with a fresh version token."""
+    st.session_state[key] = df
+    st.session_state[f"{key}_version"] = uuid.uuid4().hex
     return df
 
+@st.cache_data(max_entries=4)  # current + previous version of each table
+def _csv_bytes(_df: pd.DataFrame, version: str):
+    """Serialize a DataFrame for download.
+
+    Cached on the frame's `version` token from store_frame; `_df` itself is
+    not hashed, since Streamlit only samples large frames.
+    """
+    return _df.to_csv(index=False).encode("utf-8")
+
+def period_averages(df: pd.DataFrame, columns: list, freq: str, label: str):
+    """Average `columns` per calendar period, newest first.
+
+    `freq` is a left-labelled resample rule such as "W-MON" (weeks starting
+    Monday) or "MS" (months); periods without entries are left out.
+    """
+    resampled = df.resample(freq, on="date", closed="left", label="left")
+    means = resampled[columns].mean()[resampled.size() > 0]
+    return (
+        means.astype("float64")  # widen float32 means so rounded values display cleanly
+        .round(1)
+        .rename_axis(label)
+        .reset_index()
+        .iloc[::-1]
+    )
+
+def exercise_groups(df: pd.DataFrame):
+    """Split workouts into one frame per exercise (rows keep their date order)."""
+    return {name: group for name, group in df.groupby("exercise", sort=False, observed=True)}
+
 # ----------------- LOAD DATA -----------------
 
 workout_cols = ["date", "exercise", "sets", "reps", "weight", "notes"]
 nutrition_cols = ["date", "calories", "protein", "carbs", "fat", "sugar", "notes"]
-
-workouts_df = load_csv(WORKOUTS_FILE, workout_cols)
-nutrition_df = load_csv(NUTRITION_FILE, nutrition_cols)
-
-workouts_df = ensure_date_col(workouts_df, "date")
-nutrition_df = ensure_date_col(nutrition_df, "date")
+nutrition_numeric_cols = ["calories", "protein", "carbs", "fat", "sugar"]
+
+# Explicit dtypes skip read_csv's type inference (dates go through ensure_date_col).
+# 32-bit widths are plenty for these values and halve what aggregations scan.
+workout_dtypes = {
+    "exercise": "category",  # read_csv sorts the categories, so they double as the picker list
+    "sets": "Int32",
+    "reps": "Int32",
+    "weight": "float32",
+    "notes": "string",
+}
+nutrition_dtypes = {
+    "calories": "Int32",
+    "protein": "float32",
+    "carbs": "float32",
+    "fat": "float32",
+    "sugar": "float32",
+    "notes": "string",
+}
+
+workout_pages = ("Log Workout", "Workout History", "Import / Export")
+nutrition_pages = ("Log Nutrition", "Nutrition Summary", "Import / Export")
 
 # ----------------- UI LAYOUT -----------------
 
@@ -60,6 +205,17 @@ page = st.sidebar.radio(
     ]
 )
 
+# Only read the data the selected page actually uses, once per session;
+# adds and imports below keep the session copy and the file in sync
+if page in workout_pages:
+    if "workouts_df" not in st.session_state:
+        store_frame("workouts_df", load_csv(WORKOUTS_FILE, workout_cols, workout_dtypes))
+    workouts_df = st.session_state.workouts_df
+if page in nutrition_pages:
+    if "nutrition_df" not in st.session_state:
+        store_frame("nutrition_df", load_csv(NUTRITION_FILE, nutrition_cols, nutrition_dtypes))
+    nutrition_df = st.session_state.nutrition_df
+
 # ----------------- PAGE: LOG WORKOUT -----------------
 
 if page == "Log Workout":
@@ -86,15 +242,25 @@ if page == "Log Workout":
             "weight": float(weight),
             "notes": notes,
         }
-        workouts_df = pd.concat([workouts_df, pd.DataFrame([new_row])], ignore_index=True)
-        save_csv(workouts_df, WORKOUTS_FILE)
+        appended = append_row(WORKOUTS_FILE, workout_cols, new_row)
+        workouts_df.loc[len(workouts_df)] = {**new_row, "date": pd.Timestamp(w_date)}
+        # Enlarging with .loc drops the schema dtypes; this also rebuilds the
+        # sorted exercise categories with the new entry included
+        workouts_df = apply_schema(workouts_df, workout_cols, workout_dtypes)
+        dates = workouts_df["date"]
+        if len(dates) > 1 and dates.iat[-2] > dates.iat[-1]:  # back-dated entry
+            workouts_df = sort_by_date(workouts_df)
+        store_frame("workouts_df", workouts_df)
+        if not appended:  # stored header differs from the schema; rewrite to fix it
+            save_csv(workouts_df, WORKOUTS_FILE)
+        st.session_state.pop("workouts_by_exercise", None)
         st.success("Workout entry added.")
 
     st.subheader("Recent Workout Entries")
     if workouts_df.empty:
         st.info("No workouts logged yet.")
     else:
-        st.dataframe(workouts_df.sort_values("date", ascending=False).head(20))
+        st.dataframe(workouts_df.iloc[-20:][::-1])
 
 # ----------------- PAGE: WORKOUT HISTORY -----------------
 
@@ -104,32 +270,32 @@ elif page == "Workout History":
     if workouts_df.empty:
         st.info("No workouts logged yet. Add entries on the 'Log Workout' page.")
     else:
-        exercises = sorted(workouts_df["exercise"].dropna().unique())
+        exercises = workouts_df["exercise"].cat.categories.tolist()
         selected_exercise = st.selectbox("Select exercise to view progress:", exercises)
 
-        filtered = workouts_df[workouts_df["exercise"] == selected_exercise].copy()
-        filtered = filtered.sort_values("date")
+        # Grouped once per session and dropped whenever the workouts change
+        if "workouts_by_exercise" not in st.session_state:
+            st.session_state.workouts_by_exercise = exercise_groups(workouts_df)
+        filtered = st.session_state.workouts_by_exercise.get(selected_exercise)
 
-        if filtered.empty:
+        if filtered is None or filtered.empty:
             st.warning("No data for this exercise yet.")
         else:
             st.subheader(f"Weight Progress for: {selected_exercise}")
-            plot_df = filtered.dropna(subset=["weight"])
-            if not plot_df.empty:
-                chart_df = plot_df[["date", "weight"]].set_index("date")
-                st.line_chart(chart_df)
+            weights = filtered.set_index("date")["weight"].dropna()
+            if not weights.empty:
+                st.line_chart(weights)
             else:
                 st.info("No weight values to plot for this exercise.")
 
             st.subheader("History Table")
             st.dataframe(
-                filtered.sort_values("date", ascending=False).reset_index(drop=True)
+                filtered.iloc[::-1].reset_index(drop=True)
             )
 
             # Simple stats
-            if not plot_df.empty:
-                start_weight = plot_df["weight"].iloc[0]
-                current_weight = plot_df["weight"].iloc[-1]
+            if not weights.empty:
+                start_weight, current_weight = weights.iloc[[0, -1]].tolist()
                 change = current_weight - start_weight
                 pct_change = (change / start_weight * 100) if start_weight != 0 else 0
                 st.markdown(
@@ -167,15 +333,24 @@ elif page == "Log Nutrition":
             "sugar": float(sugar),
             "notes": n_notes,
         }
-        nutrition_df = pd.concat([nutrition_df, pd.DataFrame([new_row])], ignore_index=True)
-        save_csv(nutrition_df, NUTRITION_FILE)
+        appended = append_row(NUTRITION_FILE, nutrition_cols, new_row)
+        nutrition_df.loc[len(nutrition_df)] = {**new_row, "date": pd.Timestamp(n_date)}
+        # Enlarging with .loc widens the 32-bit columns; restore the schema dtypes
+        nutrition_df = apply_schema(nutrition_df, nutrition_cols, nutrition_dtypes)
+        dates = nutrition_df["date"]
+        if len(dates) > 1 and dates.iat[-2] > dates.iat[-1]:  # back-dated entry
+            nutrition_df = sort_by_date(nutrition_df)
+        store_frame("nutrition_df", nutrition_df)
+        if not appended:  # stored header differs from the schema; rewrite to fix it
+            save_csv(nutrition_df, NUTRITION_FILE)
+        st.session_state.pop("nutrition_summary", None)
         st.success("Nutrition entry added.")
 
     st.subheader("Recent Nutrition Entries")
     if nutrition_df.empty:
         st.info("No nutrition entries yet.")
     else:
-        st.dataframe(nutrition_df.sort_values("date", ascending=False).head(20))
+        st.dataframe(nutrition_df.iloc[-20:][::-1])
 
 # ----------------- PAGE: NUTRITION SUMMARY -----------------
 
@@ -185,37 +360,24 @@ elif page == "Nutrition Summary":
     if nutrition_df.empty:
         st.info("No nutrition data yet. Log entries on the 'Log Nutrition' page.")
     else:
-        df = nutrition_df.copy()
-        df["date"] = pd.to_datetime(df["date"])
-        df = df.sort_values("date")
+        df = nutrition_df  # already parsed and date-sorted; only read here
 
         # Daily totals
         st.subheader("Daily Totals")
-        st.dataframe(df.sort_values("date", ascending=False).reset_index(drop=True))
-
-        # Weekly averages
-        df["week"] = df["date"].dt.to_period("W").apply(lambda r: r.start_time)
-        weekly = (
-            df.groupby("week")[["calories", "protein", "carbs", "fat", "sugar"]]
-            .mean()
-            .round(1)
-            .reset_index()
-            .sort_values("week", ascending=False)
-        )
+        st.dataframe(df.iloc[::-1].reset_index(drop=True))
+
+        # Weekly / monthly averages, computed once per session and dropped
+        # whenever the nutrition data changes
+        if "nutrition_summary" not in st.session_state:
+            st.session_state.nutrition_summary = (
+                period_averages(df, nutrition_numeric_cols, "W-MON", "week"),
+                period_averages(df, nutrition_numeric_cols, "MS", "month"),
+            )
+        weekly, monthly = st.session_state.nutrition_summary
 
         st.subheader("Weekly Averages")
         st.dataframe(weekly)
 
-        # Monthly averages
-        df["month"] = df["date"].dt.to_period("M").apply(lambda r: r.start_time)
-        monthly = (
-            df.groupby("month")[["calories", "protein", "carbs", "fat", "sugar"]]
-            .mean()
-            .round(1)
-            .reset_index()
-            .sort_values("month", ascending=False)
-        )
-
         st.subheader("Monthly Averages")
         st.dataframe(monthly)
 
@@ -233,21 +395,22 @@ elif page == "Import / Export":
 
     workout_file = st.file_uploader("Upload workouts.csv", type=["csv"], key="workout_upload")
     if workout_file is not None:
-        uploaded = pd.read_csv(workout_file)
-        for col in workout_cols:
-            if col not in uploaded.columns:
-                uploaded[col] = None
-        uploaded = uploaded[workout_cols]
-        uploaded = ensure_date_col(uploaded, "date")
-        workouts_df = uploaded
-        save_csv(workouts_df, WORKOUTS_FILE)
-        st.success("Workout history imported and saved.")
+        try:
+            uploaded = read_table(workout_file, workout_cols, workout_dtypes)
+        except (ValueError, TypeError, pd.errors.ParserError) as e:
+            st.error(f"Could not import workouts CSV: {e}")
+        else:
+            uploaded = sort_by_date(ensure_date_col(uploaded, "date"))
+            workouts_df = store_frame("workouts_df", uploaded)
+            save_csv(workouts_df, WORKOUTS_FILE)
+            st.session_state.pop("workouts_by_exercise", None)
+            st.success("Workout history imported and saved.")
 
     st.subheader("Export Current Workout Data")
     if not workouts_df.empty:
         st.download_button(
             "Download workouts.csv",
-            data=workouts_df.to_csv(index=False),
+            data=_csv_bytes(workouts_df, st.session_state.workouts_df_version),
             file_name="workouts_export.csv",
             mime="text/csv",
         )
@@ -262,21 +425,22 @@ elif page == "Import / Export":
 
     nutrition_file = st.file_uploader("Upload nutrition.csv", type=["csv"], key="nutrition_upload")
     if nutrition_file is not None:
-        uploaded_n = pd.read_csv(nutrition_file)
-        for col in nutrition_cols:
-            if col not in uploaded_n.columns:
-                uploaded_n[col] = None
-        uploaded_n = uploaded_n[nutrition_cols]
-        uploaded_n = ensure_date_col(uploaded_n, "date")
-        nutrition_df = uploaded_n
-        save_csv(nutrition_df, NUTRITION_FILE)
-        st.success("Nutrition history imported and saved.")
+        try:
+            uploaded_n = read_table(nutrition_file, nutrition_cols, nutrition_dtypes)
+        except (ValueError, TypeError, pd.errors.ParserError) as e:
+            st.error(f"Could not import nutrition CSV: {e}")
+        else:
+            uploaded_n = sort_by_date(ensure_date_col(uploaded_n, "date"))
+            nutrition_df = store_frame("nutrition_df", uploaded_n)
+            save_csv(nutrition_df, NUTRITION_FILE)
+            st.session_state.pop("nutrition_summary", None)
+            st.success("Nutrition history imported and saved.")
 
     st.subheader("Export Current Nutrition Data")
     if not nutrition_df.empty:
         st.download_button(
             "Download nutrition.csv",
-            data=nutrition_df.to_csv(index=False),
+            data=_csv_bytes(nutrition_df, st.session_state.nutrition_df_version),
             file_name="nutrition_export.csv",
             mime="text/csv",
         )